@@ -0,0 +1,72 @@
+"""
+Compare the rule-based deinflection with the Mecab fallback on conjugated
+expressions that miss in the dictionary.
+
+Run from the add-on folder (Mecab is only benchmarked if the Japanese add-on
+is installed next to it):
+
+    python benchmark_deinflection.py [repetitions]
+"""
+import sys
+import time
+
+import nhk_pronunciation as nhk
+
+EXPRESSIONS = [
+    "食べた", "食べなかった", "食べませんでした", "見られる", "起きている",
+    "高くない", "高かった", "新しくて", "良くなかった",
+    "行きます", "行った", "書きたくない", "書ける", "読んでいる", "読んじゃった",
+    "聞いて", "話さない", "待って", "死んだ", "遊ぼう", "泳いだ", "帰れば",
+    "勉強した", "来ない", "来ました", "しました",
+]  # fmt: skip
+
+
+def lookup_deinflection(dictionary, expr):
+    for base_form, _ in nhk.deinflect(expr):
+        if dictionary.find_keys(base_form):
+            return base_form
+    return None
+
+
+def lookup_mecab(dictionary, mecab_reader, expr):
+    for sub_expr in mecab_reader.reading(expr).split():
+        if dictionary.find_keys(sub_expr):
+            return sub_expr
+    return None
+
+
+def bench(name, lookup, repetitions):
+    hits = sum(lookup(expr) is not None for expr in EXPRESSIONS)
+
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for expr in EXPRESSIONS:
+            lookup(expr)
+    elapsed = time.perf_counter() - start
+
+    per_lookup = elapsed / (repetitions * len(EXPRESSIONS)) * 1e6
+    print(f"{name:<14} {per_lookup:10.1f} us/lookup   {hits}/{len(EXPRESSIONS)} found")
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    dictionary = nhk.load_dictionary()
+    bench(
+        "deinflection", lambda expr: lookup_deinflection(dictionary, expr), repetitions
+    )
+
+    mecab_base_path = nhk.find_mecab()
+    if mecab_base_path is not None:
+        mecab_reader = nhk.MecabController(mecab_base_path)
+        bench(
+            "mecab",
+            lambda expr: lookup_mecab(dictionary, mecab_reader, expr),
+            repetitions,
+        )
+    else:
+        print("mecab          skipped, Japanese add-on with Mecab not found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Replay card renders through the mungeFields hook (add_pronunciation_once) at a
+target rate, and report the latency it adds per render.
+
+Anki itself is not needed: the main window and collection are replaced by
+stand-ins, and the dictionary and settings are loaded from the add-on folder.
+Run from the add-on folder:
+
+    python loadtest_render.py [--replay renders.jsonl] [--rate 200] [--budget-ms 5]
+
+A replay file holds one render per line, as {"fields": {...}, "model": {...}}.
+Without one, renders are generated from the dictionary, with --miss-ratio of
+them missing it and going through the splitting/deinflection fallbacks.
+Exits with status 1 if the p99 latency is over the budget.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import types
+
+import nhk_pronunciation as nhk
+
+# Upper bounds of the histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS = [0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100]
+
+
+def stand_in_mw():
+    """Just enough of the Anki main window and collection for the hooks"""
+    media = types.SimpleNamespace(strip=lambda txt: txt)
+    col = types.SimpleNamespace(media=media)
+    return types.SimpleNamespace(col=col, state="review")
+
+
+def read_renders(path):
+    with open(path, "r", encoding="utf-8") as f:
+        renders = [json.loads(line) for line in f if line.strip()]
+    return [(render["fields"], render["model"]) for render in renders]
+
+
+def synthetic_renders(dictionary, count, miss_ratio, seed):
+    """Make renders of dictionary words, with a share of expressions that miss"""
+    rng = random.Random(seed)
+    config = nhk.config
+    model = {"name": config["noteTypes"][0] if config["noteTypes"] else "Japanese"}
+    keys = list(dictionary.thedict.keys())
+
+    def miss():
+        kind = rng.randrange(3)
+        if kind == 0:
+            # Several words, handled by split_separators
+            return "・".join(rng.sample(keys, 2))
+        elif kind == 1:
+            # A (possibly bogus) conjugation, handled by deinflection
+            return rng.choice(keys) + rng.choice(["なかった", "ました", "くて", "んだ"])
+        return "".join(rng.choice(nhk.KATAKANA) for _ in range(6))
+
+    renders = []
+    for _ in range(count):
+        expr = miss() if rng.random() < miss_ratio else rng.choice(keys)
+        fields = {
+            config["srcFields"][0]: expr,
+            config["rdgFields"][0]: "",
+            config["dstFields"][0]: "",
+        }
+        renders.append((fields, model))
+    return renders
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[
+        min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    ]
+
+
+def report(latencies_ms, elapsed, budget_ms):
+    latencies_ms = sorted(latencies_ms)
+    print(
+        "{} renders in {:.2f} s, {:.0f} renders/s".format(
+            len(latencies_ms), elapsed, len(latencies_ms) / elapsed
+        )
+    )
+    for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p99.9", 0.999)]:
+        print("{:<6} {:9.3f} ms".format(name, percentile(latencies_ms, fraction)))
+    print("{:<6} {:9.3f} ms".format("max", latencies_ms[-1]))
+
+    print()
+    counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+    bucket = 0
+    for latency in latencies_ms:
+        while bucket < len(HISTOGRAM_BUCKETS) and latency > HISTOGRAM_BUCKETS[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+    labels = ["<= {} ms".format(b) for b in HISTOGRAM_BUCKETS]
+    labels.append("> {} ms".format(HISTOGRAM_BUCKETS[-1]))
+    for label, count in zip(labels, counts):
+        if count:
+            bar = "#" * max(1, 50 * count // len(latencies_ms))
+            print("{:>12} {:>8} {}".format(label, count, bar))
+
+    p99 = percentile(latencies_ms, 0.99)
+    print()
+    print(
+        "p99 {:.3f} ms is {} the budget of {} ms".format(
+            p99, "within" if p99 <= budget_ms else "OVER", budget_ms
+        )
+    )
+    return p99 <= budget_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--replay", help="file with recorded renders, one json per line"
+    )
+    parser.add_argument("--count", type=int, default=5000, help="synthetic renders")
+    parser.add_argument("--miss-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="renders per second, 0 for no limit"
+    )
+    parser.add_argument("--budget-ms", type=float, default=5.0)
+    parser.add_argument(
+        "--cold", action="store_true", help="clear the lookup cache before each render"
+    )
+    parser.add_argument(
+        "--mecab", action="store_true", help="fall back to Mecab, if it is installed"
+    )
+    args = parser.parse_args()
+
+    nhk.mw = stand_in_mw()
+    segmenter = None
+    mecab_base_path = nhk.find_mecab() if args.mecab else None
+    if mecab_base_path is not None:
+        segmenter = nhk.MecabController(mecab_base_path)
+    nhk.engine = nhk.PronunciationEngine(nhk.load_dictionary(), nhk.config, segmenter)
+
+    if args.replay:
+        renders = read_renders(args.replay)
+    else:
+        renders = synthetic_renders(
+            nhk.engine.dictionary, args.count, args.miss_ratio, args.seed
+        )
+
+    interval = 1.0 / args.rate if args.rate else 0
+    latencies_ms = []
+    start = time.perf_counter()
+    for i, (fields, model) in enumerate(renders):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if args.cold:
+            nhk.engine.clear_cache()
+
+        # The hook fills in fields in place, so give it a fresh copy every time
+        fields = dict(fields)
+        render_start = time.perf_counter()
+        nhk.add_pronunciation_once(fields, model, None, None)
+        latencies_ms.append((time.perf_counter() - render_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    if not report(latencies_ms, elapsed, args.budget_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,45 @@
 # -*- coding: utf-8 -*-
+import functools
+import glob
+import gzip
+import hashlib
+import itertools
+import json
 import os.path
 import re
 import subprocess
 import sys
+import threading
+import time
+import unicodedata
+import zlib
 from collections import OrderedDict, namedtuple
 
 if sys.version_info.major == 3:
     import pickle
     from html.parser import HTMLParser
-
-    from PyQt6.QtWidgets import *
 else:
     import cPickle as pickle
     from HTMLParser import HTMLParser
 
-import anki
-from anki.hooks import addHook
-from aqt import gui_hooks, mw
-from aqt.qt import *
-from aqt.utils import isMac, isWin, showInfo, showText
+try:
+    import anki
+    from anki.hooks import addHook
+    from aqt import gui_hooks, mw
+    from aqt.qt import *
+    from aqt.utils import isMac, isWin, showInfo, showText
+except ImportError:
+    # Imported outside of Anki (e.g. by prepare_release.py): only the
+    # dictionary and lookup functions are usable.
+    mw = None
+    isMac = sys.platform == "darwin"
+    isWin = sys.platform == "win32"
+    showInfo = print
+    # Lets the dialog classes below be defined, even though they can't be shown
+    QDialog = object
+
+if mw is not None and sys.version_info.major == 3:
+    from PyQt6.QtWidgets import *
 
 # ************************************************
 #                Global Variables                *
@@ -29,8 +50,14 @@ dir_path = os.path.dirname(os.path.normpath(__file__))
 thisfile = os.path.join(dir_path, "nhk_pronunciation.py")
 derivative_database = os.path.join(dir_path, "nhk_pronunciation.csv")
 derivative_pickle = os.path.join(dir_path, "nhk_pronunciation.pickle")
+prebuilt_cache = os.path.join(dir_path, "nhk_pronunciation_dict.pickle.gz")
+user_files_path = os.path.join(dir_path, "user_files")
 accent_database = os.path.join(dir_path, "ACCDB_unicode.csv")
 
+# Bump this whenever the layout or the index keys of the dictionary cache
+# change, so that stale pickles and prebuilt caches are ignored instead of loaded
+DICT_CACHE_VERSION = 4
+
 # "Class" declaration
 AccentEntry = namedtuple(
     "AccentEntry",
@@ -59,13 +86,18 @@ AccentEntry = namedtuple(
 DatabaseEntry = namedtuple(
     typename="DatabaseEntry", field_names=["midashigo", "ac", "nasalpos", "nopronpos"]
 )
-
-# The main dict used to store all entries
-thedict: dict[str, list[DatabaseEntry]] = {}
+# The pronunciation of a single word, as found by the lookup functions:
+# - kana: the kana spelling, one per accent position
+# - sections: lengths of the low pre-rise, high, fall and low post-fall sections
+# - nasal, devoiced: (0-based) indices into kana of nasal and devoiced kana
+# - particle: the particle following the word, if any
+# - ended_high: whether the pitch is still high at the end of the word
+Pronunciation = namedtuple(
+    "Pronunciation",
+    ["kana", "sections", "nasal", "devoiced", "particle", "ended_high"],
+)
 
 if sys.version_info.major == 2:
-    import json
-
     config = json.load(
         open(
             os.path.join(dir_path, "nhk_pronunciation_config.json"),
@@ -73,41 +105,12 @@ if sys.version_info.major == 2:
             encoding="utf-8",
         )
     )
-else:
-    config = mw.addonManager.getConfig(__name__)
-
-# Check if Mecab is available and/or if the user wants it to be used
-if config["useMecab"]:
-    lookup_mecab = True
-else:
-    lookup_mecab = False
-
-if sys.version_info.major == 3:
-    import glob
-
-    # Note that there are no guarantees on the folder name of the Japanese
-    # add-on. We therefore have to look recursively in our parent folder.
-    mecab_search = glob.glob(
-        os.path.join(
-            dir_path,
-            os.pardir + os.sep + "**" + os.sep + "support" + os.sep + "mecab.exe",
-        )
+elif mw is None:
+    config = json.load(
+        open(os.path.join(dir_path, "config.json"), "r", encoding="utf-8")
     )
-    mecab_exists = len(mecab_search) > 0
-    if mecab_exists:
-        mecab_base_path = os.path.dirname(os.path.normpath(mecab_search[0]))
 else:
-    mecab_exists = os.path.exists(
-        os.path.join(dir_path, "japanese" + os.sep + "support" + os.sep + "mecab.exe")
-    )
-    if mecab_exists:
-        mecab_base_path = os.path.join(dir_path, "japanese" + os.sep + "support")
-
-if lookup_mecab and not mecab_exists:
-    showInfo(
-        "NHK-Pronunciation: Mecab use requested, but Japanese add-on with Mecab not found."
-    )
-    lookup_mecab = False
+    config = mw.addonManager.getConfig(__name__)
 
 
 # ************************************************
@@ -127,16 +130,97 @@ KATAKANA = (
 )
 
 
+SMALL_KANA = "ぁぃぅぇぉゃゅょァィゥェォャュョ"
+
+PITCH_PATTERNS = ["heiban", "atamadaka", "nakadaka", "odaka"]
+
+KATAKANA_TO_HIRAGANA = str.maketrans(KATAKANA, HIRAGANA)
+HIRAGANA_TO_KATAKANA = str.maketrans(HIRAGANA, KATAKANA)
+
+# The vowel a long-vowel mark stands for, keyed by the (hiragana) kana preceding it
+LONG_VOWELS = {
+    kana: vowel
+    for vowel, row in [
+        ("あ", "あかさたなはまやらわがざだばぱぁゃ"),
+        ("い", "いきしちにひみりぎじぢびぴぃ"),
+        ("う", "うくすつぬふむゆるぐずづぶぷぅゅ"),
+        ("え", "えけせてねへめれげぜでべぺぇ"),
+        ("お", "おこそとのほもよろをごぞどぼぽぉょ"),
+    ]
+    for kana in row
+}
+
+
 def katakana_to_hiragana(to_translate):
-    katakana_ords = [ord(char) for char in KATAKANA]
-    translate_table = dict(zip(katakana_ords, HIRAGANA))
-    return to_translate.translate(translate_table)
+    return to_translate.translate(KATAKANA_TO_HIRAGANA)
 
 
 def hiragana_to_katakana(to_translate):
-    hiragana_ords = [ord(char) for char in HIRAGANA]
-    translate_table = dict(zip(hiragana_ords, KATAKANA))
-    return to_translate.translate(translate_table)
+    return to_translate.translate(HIRAGANA_TO_KATAKANA)
+
+
+def count_morae(kana):
+    """Count the morae of a kana spelling; small ya/yu/yo and vowels join the kana before them"""
+    return sum(1 for char in kana if char not in SMALL_KANA)
+
+
+def is_kanji(char):
+    return "\u4e00" <= char <= "\u9fff" or "\u3400" <= char <= "\u4dbf"
+
+
+def normalize_kana(expr):
+    """Normalize the width, script and long-vowel marks of kana, e.g. ｺｰﾋｰ -> こおひい"""
+    expr = unicodedata.normalize("NFKC", expr)
+    expr = katakana_to_hiragana("".join(expr.split()))
+
+    chars = []
+    for char in expr:
+        if char == "ー" and chars and chars[-1] in LONG_VOWELS:
+            char = LONG_VOWELS[chars[-1]]
+        chars.append(char)
+
+    return "".join(chars)
+
+
+def normalize_key(expr):
+    """
+    Reduce an expression to a spelling-insensitive key, so that trivial variants
+    (katakana/hiragana, full-/half-width, long-vowel marks, whitespace and
+    okurigana) of the same word end up with the same key.
+
+    Keys are deliberately loose, e.g. 日の出 and 日出 share one, so candidates
+    found by key still have to be checked with kana_fit_reading.
+    """
+    expr = normalize_kana(expr)
+
+    chars = []
+    after_kanji = False
+    for i, char in enumerate(expr):
+        if is_kanji(char):
+            after_kanji = True
+        elif char not in HIRAGANA:
+            after_kanji = False
+        elif after_kanji and i + 1 < len(expr):
+            # Okurigana, except the final kana, e.g. 取り扱い -> 取扱い, 行なう -> 行う
+            continue
+        chars.append(char)
+
+    return "".join(chars)
+
+
+def kana_fit_reading(expr, reading):
+    """
+    Check if the kana of an expression fit a reading, with each run of other
+    characters standing for one or more kana, e.g. 日の出 fits ひので but
+    not じっしゅつ.
+    """
+    pattern = "".join(
+        re.escape("".join(chars)) if is_kana else ".+"
+        for is_kana, chars in itertools.groupby(
+            normalize_kana(expr), lambda char: char in HIRAGANA
+        )
+    )
+    return re.fullmatch(pattern, normalize_kana(reading)) is not None
 
 
 class HTMLTextExtractor(HTMLParser):
@@ -182,6 +266,8 @@ jp_sep_regex = re.compile(
     "[・、※【】「」〒◎×〃゜『』《》〜〽。〄〇〈〉〓〔〕〖〗〘 〙〚〛〝 〞〟〠〡〢〣〥〦〧〨〫  〬  〭  〮〯〶〷〸〹〺〻〼〾〿]",
     re.U,
 )
+# Html tags and sound references in a field, which separators are not removed from
+field_markup_regex = re.compile(r"(<[^>]*>|\[sound:[^\]]*\])")
 
 
 def split_separators(expr):
@@ -210,6 +296,8 @@ class MecabController:
     def __init__(self, base_path):
         self.mecab = None
         self.base_path = os.path.normpath(base_path)
+        # Requests and replies share one pipe, so only one thread may use it at a time
+        self.lock = threading.Lock()
 
         if sys.platform == "win32":
             self._si = subprocess.STARTUPINFO()
@@ -272,12 +360,13 @@ class MecabController:
         return text
 
     def reading(self, expr):
-        self.ensureOpen()
         expr = self._escapeText(expr)
         try:
-            self.mecab.stdin.write(expr.encode("utf-8", "ignore") + b"\n")
-            self.mecab.stdin.flush()
-            expr = self.mecab.stdout.readline().rstrip(b"\r\n").decode("utf-8")
+            with self.lock:
+                self.ensureOpen()
+                self.mecab.stdin.write(expr.encode("utf-8", "ignore") + b"\n")
+                self.mecab.stdin.flush()
+                expr = self.mecab.stdout.readline().rstrip(b"\r\n").decode("utf-8")
         except UnicodeDecodeError as e:
             raise Exception(
                 str(e)
@@ -287,68 +376,242 @@ class MecabController:
         return expr
 
 
-if lookup_mecab:
-    mecab_reader = MecabController(mecab_base_path)
+def find_mecab():
+    """Find the folder with the Mecab binaries of the Japanese add-on, or None"""
+    if sys.version_info.major == 3:
+        # Note that there are no guarantees on the folder name of the Japanese
+        # add-on. We therefore have to look recursively in our parent folder.
+        mecab_search = glob.glob(
+            os.path.join(
+                dir_path,
+                os.pardir + os.sep + "**" + os.sep + "support" + os.sep + "mecab.exe",
+            )
+        )
+        if mecab_search:
+            return os.path.dirname(os.path.normpath(mecab_search[0]))
+    else:
+        mecab_base_path = os.path.join(dir_path, "japanese" + os.sep + "support")
+        if os.path.exists(os.path.join(mecab_base_path, "mecab.exe")):
+            return mecab_base_path
+    return None
 
 
 # ************************************************
-#           Database generation functions        *
+#                  Deinflection                  *
 # ************************************************
-def format_entry(
-    e: DatabaseEntry, kana_spelling: str = None, prev_pitch_high: bool = False
-) -> tuple[str, bool]:
-    """Format an entry from the data in the derivative database to something that uses html"""
-    txt = list(e.midashigo[:]) if kana_spelling is None else list(kana_spelling)
-    strlen = len(txt)
-    acclen = len(e.ac)
-    accent = "0" * (strlen - acclen) + e.ac
-
-    # Nasalization
-    if config["includeNasalPronunciation"] and e.nasalpos != "-":
-        for str_idx in e.nasalpos:
-            idx = int(str_idx) - 1
-            txt[idx] = f'<span class="pron-nasal">{txt[idx]}</span>'
-
-    # Devoiced kana
-    if config["includeNoPronunciation"] and e.nopronpos != "-":
-        for str_idx in e.nopronpos:
-            idx = int(str_idx) - 1
-            txt[idx] = f'<span class="pron-no">{txt[idx]}</span>'
-
-    # Each word has at most 1 rise and at most 1 fall in pitch, so we can split the word into 4 sections:
-    # 1. Low pitch, pre-rise
-    # 2. High pitch
-    # 3. Fall in pitch
-    # 4. Low pitch, post-fall
-    pre_fall, fall, low_post_fall = accent.partition("2")
-    low_pre_rise, rise_char, post_rise = pre_fall.partition("1")
-    high = rise_char + post_rise
-
-    if prev_pitch_high:
-        # Pitch stays high until it hits a fall
-        low_pre_rise, high = "", low_pre_rise + high
 
-    output = ""
-    chunk_txt = txt[:]
-    split_at_idx = lambda _txt, _idx: (_txt[:_idx], _txt[_idx:])
-    rejoin = lambda s: "".join(s)
-
-    if len(low_pre_rise) != 0:
-        substr, chunk_txt = split_at_idx(chunk_txt, len(low_pre_rise))
-        output += f'<span class="pitch-low-pre">{rejoin(substr)}</span>'
-    if len(high) != 0:
-        substr, chunk_txt = split_at_idx(chunk_txt, len(high))
-        output += f'<span class="pitch-high">{rejoin(substr)}</span>'
-    if len(fall) != 0:
-        substr, chunk_txt = split_at_idx(chunk_txt, len(fall))
-        output += f'<span class="pitch-fall">{rejoin(substr)}</span>'
-    if len(low_post_fall) != 0:
-        substr, chunk_txt = split_at_idx(chunk_txt, len(low_post_fall))
-        output += f'<span class="pitch-low-post">{rejoin(substr)}</span>'
-
-    return output, len(fall) == 0  # pitch ends high
+# Word classes, as bit flags so a rule can accept several of them
+V1 = 1  # Ichidan verb
+V5 = 2  # Godan verb
+VS = 4  # Suru verb
+VK = 8  # Kuru verb
+ADJ_I = 16  # I-adjective (also the negative ない and desiderative たい forms)
+MASU = 32  # Polite ます form
+TE = 64  # Te form followed by an auxiliary verb
+NOUN = 128  # Noun taking する
+ANY = V1 | V5 | VS | VK | ADJ_I | MASU | TE | NOUN
+DICTIONARY_FORMS = V1 | V5 | VS | VK | ADJ_I | NOUN
+
+DeinflectionRule = namedtuple(
+    "DeinflectionRule", ["inflected", "base", "rules_in", "rules_out"]
+)
 
+# Verbs a rule may deinflect from the whole expression. Otherwise a suffix
+# alone would turn e.g. かった into い and いて into く, which are words too.
+WHOLE_WORD_VERBS = {"する", "くる", "来る", "行く", "いく"}
+
+# Godan verbs by dictionary-form ending: a-, i-, e- and o-row kana, te form, ta form
+GODAN_ROWS = [
+    ("う", "わ", "い", "え", "お", "って", "った"),
+    ("く", "か", "き", "け", "こ", "いて", "いた"),
+    ("ぐ", "が", "ぎ", "げ", "ご", "いで", "いだ"),
+    ("す", "さ", "し", "せ", "そ", "して", "した"),
+    ("つ", "た", "ち", "て", "と", "って", "った"),
+    ("ぬ", "な", "に", "ね", "の", "んで", "んだ"),
+    ("ぶ", "ば", "び", "べ", "ぼ", "んで", "んだ"),
+    ("む", "ま", "み", "め", "も", "んで", "んだ"),
+    ("る", "ら", "り", "れ", "ろ", "って", "った"),
+]
+
+
+def make_deinflection_rules():
+    """Expand the conjugation paradigms into (inflected suffix -> base suffix) rules"""
+    rules = []
+
+    def add(inflected, base, rules_in, rules_out):
+        rules.append(DeinflectionRule(inflected, base, rules_in, rules_out))
+
+    # Endings shared by all verbs, keyed by the stem they attach to
+    for u, a, i, e, o, te, ta in GODAN_ROWS:
+        add(a + "ない", u, ADJ_I, V5)
+        add(a + "れる", u, V1, V5)  # Passive
+        add(a + "せる", u, V1, V5)  # Causative
+        add(a + "ず", u, ANY, V5)
+        add(i + "ます", u, MASU, V5)
+        add(i + "たい", u, ADJ_I, V5)
+        add(i + "ながら", u, ANY, V5)
+        add(i, u, ANY, V5)  # Continuative
+        add(e + "る", u, V1, V5)  # Potential
+        add(e + "ば", u, ANY, V5)
+        add(e, u, ANY, V5)  # Imperative
+        add(o + "う", u, ANY, V5)
+        add(te, u, ANY | TE, V5)
+        add(ta, u, ANY, V5)
+        add(ta + "ら", u, ANY, V5)
+        add(ta + "り", u, ANY, V5)
+    # 行く is the one irregular godan verb
+    for stem in ["行", "い"]:
+        add(stem + "って", stem + "く", ANY | TE, V5)
+        add(stem + "った", stem + "く", ANY, V5)
+        add(stem + "ったら", stem + "く", ANY, V5)
+
+    for inflected, rules_in in [
+        ("ない", ADJ_I),
+        ("られる", V1),
+        ("れる", V1),
+        ("させる", V1),
+        ("ず", ANY),
+        ("ます", MASU),
+        ("たい", ADJ_I),
+        ("ながら", ANY),
+        ("れば", ANY),
+        ("よう", ANY),
+        ("ろ", ANY),
+        ("て", ANY | TE),
+        ("た", ANY),
+        ("たら", ANY),
+        ("たり", ANY),
+    ]:
+        add(inflected, "る", rules_in, V1)
+
+    for inflected, rules_in in [
+        ("しない", ADJ_I),
+        ("される", V1),
+        ("させる", V1),
+        ("せず", ANY),
+        ("します", MASU),
+        ("したい", ADJ_I),
+        ("しながら", ANY),
+        ("できる", V1),
+        ("すれば", ANY),
+        ("しよう", ANY),
+        ("しろ", ANY),
+        ("せよ", ANY),
+        ("して", ANY | TE),
+        ("した", ANY),
+        ("したら", ANY),
+        ("したり", ANY),
+    ]:
+        add(inflected, "する", rules_in, VS)
+    # The noun of a suru verb carries the accent we are after
+    add("する", "", ANY, NOUN)
+
+    for prefix, kuru in [("来", "来る"), ("", "くる")]:
+        for inflected, rules_in in [
+            ("こない", ADJ_I),
+            ("こられる", V1),
+            ("こさせる", V1),
+            ("きます", MASU),
+            ("きたい", ADJ_I),
+            ("くれば", ANY),
+            ("こよう", ANY),
+            ("こい", ANY),
+            ("きて", ANY | TE),
+            ("きた", ANY),
+            ("きたら", ANY),
+            ("きたり", ANY),
+        ]:
+            if prefix:
+                inflected = prefix + inflected[1:]
+            add(inflected, kuru, rules_in, VK)
+
+    # Conjugations of ます
+    for inflected in ["ました", "ません", "ませんでした", "ましょう", "まして"]:
+        add(inflected, "ます", ANY, MASU)
+
+    # Auxiliary verbs following the te form
+    for te in ["て", "で"]:
+        for aux, rules_in in [
+            ("いる", V1),
+            ("る", V1),
+            ("おく", V5),
+            ("しまう", V5),
+            ("ある", V5),
+            ("くる", VK),
+            ("いく", V5),
+        ]:
+            add(te + aux, te, rules_in, TE)
+    add("とく", "て", V5, TE)
+    add("どく", "で", V5, TE)
+    add("ちゃう", "て", V5, TE)
+    add("じゃう", "で", V5, TE)
+
+    # I-adjectives
+    for inflected, rules_in in [
+        ("くない", ADJ_I),
+        ("かった", ANY),
+        ("かったら", ANY),
+        ("くて", ANY | TE),
+        ("ければ", ANY),
+        ("く", ANY),
+        ("さ", ANY),
+        ("そう", ANY),
+        ("くなる", V5),
+        ("くありません", ANY),
+    ]:
+        add(inflected, "い", rules_in, ADJ_I)
+
+    return rules
+
+
+def compile_deinflection_rules(rules):
+    """Group the rules by suffix length and suffix for O(1) matching"""
+    table = {}
+    for rule in rules:
+        table.setdefault(len(rule.inflected), {}).setdefault(rule.inflected, []).append(
+            rule
+        )
+    return sorted(table.items(), reverse=True)
+
+
+deinflection_table = compile_deinflection_rules(make_deinflection_rules())
+
+
+def deinflect(expr: str, max_depth: int = 4) -> list[tuple[str, int]]:
+    """
+    List the possible dictionary forms of a conjugated expression, together
+    with their word class, closest candidates first. The candidates are not
+    checked against the dictionary.
+    """
+    candidates = [(expr, ANY)]
+    seen = set(candidates)
+    depth_start, depth_end = 0, 1
+
+    for _ in range(max_depth):
+        for word, word_class in candidates[depth_start:depth_end]:
+            for length, suffixes in deinflection_table:
+                if length > len(word):
+                    continue
+                for rule in suffixes.get(word[-length:], ()):
+                    if not rule.rules_in & word_class:
+                        continue
+                    stem = word[:-length]
+                    if not stem and rule.base not in WHOLE_WORD_VERBS:
+                        continue
+                    candidate = (stem + rule.base, rule.rules_out)
+                    if candidate[0] and candidate not in seen:
+                        seen.add(candidate)
+                        candidates.append(candidate)
+        depth_start, depth_end = depth_end, len(candidates)
+        if depth_start == depth_end:
+            break
 
+    return [c for c in candidates[1:] if c[1] & DICTIONARY_FORMS]
+
+
+# ************************************************
+#           Database generation functions        *
+# ************************************************
 def unformat_accdb_indices(idxs: str) -> str:
     if idxs:
         return "".join(idxs.split("0"))
@@ -396,6 +659,7 @@ def build_database():
 
 def read_derivative():
     """Read the derivative file to memory"""
+    thedict = {}
     with open(derivative_database, "r", encoding="utf-8") as f:
         for line in f:
             key_value_entry = line.strip().split("\t")
@@ -406,196 +670,894 @@ def read_derivative():
                     thedict[key].append(database_entry)
             else:
                 thedict[key] = [database_entry]
+    return thedict
+
+
+def build_fuzzy_index(thedict):
+    """Index the keys of the main dict by their normalized spelling"""
+    tempdict = {}
+    for key in thedict.keys():
+        tempdict.setdefault(normalize_key(key), []).append(key)
+
+    return {k: tuple(v) for k, v in tempdict.items()}
+
+
+def entry_pitch_key(e: DatabaseEntry) -> tuple[int, int, bool, bool]:
+    """The (mora count, downstep position, has nasal, has devoiced) key of an entry"""
+    accent = "0" * (len(e.midashigo) - len(e.ac)) + e.ac
+    fall_idx = accent.find("2")
+    # Heiban words have no downstep, which we record as position 0
+    downstep = count_morae(e.midashigo[: fall_idx + 1]) if fall_idx >= 0 else 0
+    return (
+        count_morae(e.midashigo),
+        downstep,
+        e.nasalpos != "-",
+        e.nopronpos != "-",
+    )
+
+
+def build_pitch_index(thedict):
+    """Index the entries of the main dict by their pitch pattern"""
+    entry_exprs = OrderedDict()
+    for key, entries in thedict.items():
+        for database_entry in entries:
+            entry_exprs.setdefault(database_entry, []).append(key)
+
+    tempdict = {}
+    for database_entry, exprs in entry_exprs.items():
+        tempdict.setdefault(entry_pitch_key(database_entry), []).append(
+            (tuple(exprs), database_entry)
+        )
+
+    return OrderedDict(sorted(tempdict.items()))
+
+
+def pitch_pattern(morae: int, downstep: int) -> str:
+    """Name the pitch pattern of a word from its mora count and downstep position"""
+    if downstep == 0:
+        return "heiban"
+    elif downstep == 1:
+        return "atamadaka"
+    elif downstep == morae:
+        return "odaka"
+    return "nakadaka"
+
+
+class DictionaryUnpickler(pickle.Unpickler):
+    """
+    Unpickles dictionary caches whatever this module was called when they were
+    written: prepare_release.py imports it as nhk_pronunciation, while Anki
+    imports it as part of the add-on package, whose name varies.
+    """
+
+    def find_class(self, module, name):
+        if module.split(".")[-1] == "nhk_pronunciation" and name == "DatabaseEntry":
+            return DatabaseEntry
+        return super(DictionaryUnpickler, self).find_class(module, name)
+
+
+class PronunciationDictionary:
+    """
+    The accent dictionary together with the indices derived from it. It is
+    not modified after it is built, so one instance can be shared by any
+    number of engines and threads.
+    """
+
+    def __init__(self, thedict, fuzzydict, pitchdict, signature):
+        # The main dict used to store all entries
+        self.thedict: dict[str, list[DatabaseEntry]] = thedict
+        # Secondary index mapping normalized spellings to the matching keys of thedict
+        self.fuzzydict: dict[str, tuple[str, ...]] = fuzzydict
+        # Index of the dictionary entries by (mora count, downstep position, has
+        # nasal kana, has devoiced kana), each mapping to (expressions, entry) pairs
+        self.pitchdict: dict[
+            tuple[int, int, bool, bool], list[tuple[tuple[str, ...], DatabaseEntry]]
+        ] = pitchdict
+        # Hash of the dictionary contents, to tell when stored pronunciations are outdated
+        self.signature: str = signature
+
+    @classmethod
+    def build(cls, thedict):
+        """Build everything derived from the main dict that is cached along with it"""
+        return cls(
+            thedict,
+            build_fuzzy_index(thedict),
+            build_pitch_index(thedict),
+            hashlib.sha1(pickle.dumps(thedict, pickle.HIGHEST_PROTOCOL)).hexdigest(),
+        )
+
+    def write_cache(self, path, compress=False):
+        """Write the dictionary and its indices to a versioned cache"""
+        opener = gzip.open if compress else open
+        with opener(path, "wb") as f:
+            pickle.dump(
+                {
+                    "version": DICT_CACHE_VERSION,
+                    "signature": self.signature,
+                    "thedict": self.thedict,
+                    "fuzzydict": self.fuzzydict,
+                    "pitchdict": self.pitchdict,
+                },
+                f,
+                pickle.HIGHEST_PROTOCOL,
+            )
+
+    @classmethod
+    def read_cache(cls, path, compress=False):
+        """
+        Load a cache written by write_cache. Returns None if the cache is from
+        another version, or is truncated or otherwise unreadable.
+        """
+        opener = gzip.open if compress else open
+        try:
+            with opener(path, "rb") as f:
+                cached = DictionaryUnpickler(f).load()
+        except (
+            EOFError,
+            OSError,
+            ValueError,
+            AttributeError,
+            ImportError,
+            IndexError,
+            pickle.UnpicklingError,
+            zlib.error,
+        ):
+            return None
+
+        # Pickles from older versions hold only the main dict
+        if not isinstance(cached, dict) or cached.get("version") != DICT_CACHE_VERSION:
+            return None
+
+        return cls(
+            cached["thedict"],
+            cached["fuzzydict"],
+            cached["pitchdict"],
+            cached["signature"],
+        )
+
+    def find_keys(self, expr: str, rdg: str = None) -> tuple[str, ...]:
+        """
+        Find the keys of the main dict an expression refers to, falling back to
+        the normalized index if the expression is not a key itself.
+
+        Keys found through the index must fit the kana of the expression (and
+        the reading, if given). If they still belong to different words, none
+        are returned rather than mixing up their pronunciations.
+        """
+        if expr in self.thedict:
+            return (expr,)
+
+        key_readings = OrderedDict()
+        for key in self.fuzzydict.get(normalize_key(expr), ()):
+            readings = frozenset(
+                e.midashigo
+                for e in self.thedict[key]
+                if kana_fit_reading(expr, e.midashigo)
+                and (not rdg or kana_fit_reading(rdg, e.midashigo))
+            )
+            if readings:
+                key_readings[key] = readings
+
+        if len(set(key_readings.values())) > 1:
+            return ()
+        return tuple(key_readings)
+
+    def queryPitchPatterns(
+        self,
+        morae: int = None,
+        downstep: int = None,
+        pattern: str = None,
+        nasal: bool = None,
+        devoiced: bool = None,
+        prefix: str = None,
+    ):
+        """
+        Search the dictionary for words with a particular pitch pattern. Filters
+        left at None match anything; prefix matches the start of either the
+        reading or one of the written forms.
+
+        Yields (expressions, entry) pairs lazily, so use itertools.islice to page.
+        """
+        prefix_kana = hiragana_to_katakana(prefix) if prefix else None
+
+        for (m, d, n, v), entries in self.pitchdict.items():
+            if (
+                (morae is not None and m != morae)
+                or (downstep is not None and d != downstep)
+                or (pattern is not None and pitch_pattern(m, d) != pattern)
+                or (nasal is not None and n != nasal)
+                or (devoiced is not None and v != devoiced)
+            ):
+                continue
+
+            for exprs, database_entry in entries:
+                if prefix and not (
+                    database_entry.midashigo.startswith(prefix_kana)
+                    or any(expr.startswith(prefix) for expr in exprs)
+                ):
+                    continue
+                yield exprs, database_entry
+
+
+def load_dictionary() -> PronunciationDictionary:
+    """
+    Load the dictionary, preferring the prebuilt cache shipped with the release
+    and otherwise (re)generating the derivative database and pickle.
+    """
+    if os.path.exists(prebuilt_cache):
+        dictionary = PronunciationDictionary.read_cache(prebuilt_cache, compress=True)
+        if dictionary is not None:
+            return dictionary
+
+    # Releases only ship the prebuilt cache, so without it there is nothing to fall back on
+    if not os.path.exists(derivative_database) and not os.path.exists(accent_database):
+        raise IOError(
+            "NHK-Pronunciation: the prebuilt dictionary is missing, corrupt or from "
+            "another version of the add-on. Please reinstall the add-on."
+        )
+
+    # Generate the derivative database if it does not exist yet
+    if (
+        os.path.exists(accent_database) and not os.path.exists(derivative_database)
+    ) or (
+        os.path.exists(accent_database)
+        and os.stat(thisfile).st_mtime > os.stat(derivative_database).st_mtime
+    ):
+        build_database()
+
+    # If a pickle exists of the derivative file, use that. Otherwise, read from the derivative file and generate a pickle.
+    if (
+        os.path.exists(derivative_pickle)
+        and os.stat(derivative_pickle).st_mtime > os.stat(derivative_database).st_mtime
+    ):
+        dictionary = PronunciationDictionary.read_cache(derivative_pickle)
+        if dictionary is not None:
+            return dictionary
+
+    dictionary = PronunciationDictionary.build(read_derivative())
+    dictionary.write_cache(derivative_pickle)
+    return dictionary
 
 
 # ************************************************
-#              Lookup Functions                  *
+#                  Renderers                     *
+#  Each renders a phrase, i.e. a sequence of     *
+#  Pronunciations of consecutive words.          *
 # ************************************************
-def inline_style(txt):
-    """Map style classes to their inline version"""
-    if config["inlineStyle"]:
-        for k, v in config["styles"].items():
-            txt = txt.replace(k, v)
+HTML_SECTIONS = [
+    '<span class="pitch-low-pre">{}</span>'.format,
+    '<span class="pitch-high">{}</span>'.format,
+    '<span class="pitch-fall">{}</span>'.format,
+    '<span class="pitch-low-post">{}</span>'.format,
+]
+HTML_NASAL = '<span class="pron-nasal">{}</span>'.format
+HTML_DEVOICED = '<span class="pron-no">{}</span>'.format
+HTML_PARTICLE = '<span class="pitch-particle">{}</span>'.format
+
+
+def render_html(phrase) -> str:
+    """Render as html spans, styled by the pitch-* and pron-* classes"""
+    output = ""
+    for pron in phrase:
+        txt = list(pron.kana)
+        for idx in pron.nasal:
+            txt[idx] = HTML_NASAL(txt[idx])
+        for idx in pron.devoiced:
+            txt[idx] = HTML_DEVOICED(txt[idx])
+
+        start = 0
+        for template, length in zip(HTML_SECTIONS, pron.sections):
+            if length != 0:
+                output += template("".join(txt[start : start + length]))
+                start += length
+
+        if pron.particle is not None:
+            output += HTML_PARTICLE(pron.particle)
+
+    return output
+
+
+def pitch_levels(pron: Pronunciation) -> list[tuple[str, bool]]:
+    """List (kana, is high) per mora; small kana are joined to the kana before them"""
+    low_pre_rise, high, fall, _ = pron.sections
+    levels = []
+    for idx, char in enumerate(pron.kana):
+        if char in SMALL_KANA and levels:
+            levels[-1] = (levels[-1][0] + char, levels[-1][1])
+        else:
+            levels.append((char, low_pre_rise <= idx < low_pre_rise + high + fall))
+    return levels
+
+
+SVG_STEP = 24
+SVG_HIGH_Y = 8
+SVG_LOW_Y = 28
+SVG_GRAPH = (
+    '<svg class="pitch-graph" xmlns="http://www.w3.org/2000/svg" '
+    'width="{width}" height="52" viewBox="0 0 {width} 52">'
+    '<polyline points="{points}" fill="none" stroke="currentColor" stroke-width="1.5"/>'
+    "{dots}{labels}</svg>"
+).format
+SVG_DOT = '<circle cx="{}" cy="{}" r="4" fill="currentColor"/>'.format
+SVG_PARTICLE_DOT = (
+    '<circle cx="{}" cy="{}" r="4" fill="white" stroke="currentColor"/>'.format
+)
+SVG_LABEL = '<text x="{}" y="48" font-size="14" text-anchor="middle">{}</text>'.format
+
+
+def render_svg(phrase) -> str:
+    """Render as an svg pitch graph, with a dot per mora and hollow dots for particles"""
+    morae = []
+    for pron in phrase:
+        morae.extend((char, is_high, False) for char, is_high in pitch_levels(pron))
+        if pron.particle is not None:
+            morae.extend((char, pron.ended_high, True) for char in pron.particle)
+    if not morae:
+        return ""
+
+    points, dots, labels = [], [], []
+    for idx, (char, is_high, is_particle) in enumerate(morae):
+        x = SVG_STEP // 2 + idx * SVG_STEP
+        y = SVG_HIGH_Y if is_high else SVG_LOW_Y
+        points.append("{},{}".format(x, y))
+        dots.append((SVG_PARTICLE_DOT if is_particle else SVG_DOT)(x, y))
+        labels.append(SVG_LABEL(x, char))
+
+    return SVG_GRAPH(
+        width=len(morae) * SVG_STEP,
+        points=" ".join(points),
+        dots="".join(dots),
+        labels="".join(labels),
+    )
+
+
+JSON_ENCODE = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+def render_json(phrase) -> str:
+    """Render as a json list with an object per word, for use by card scripts"""
+    if not phrase:
+        return ""
+    return JSON_ENCODE(
+        [
+            {
+                "kana": pron.kana,
+                "sections": pron.sections,
+                "nasal": pron.nasal,
+                "devoiced": pron.devoiced,
+                "particle": pron.particle,
+                "endedHigh": pron.ended_high,
+            }
+            for pron in phrase
+        ]
+    )
+
 
-    return txt
+DOWNSTEP_MARK = "＼"
+
+
+def render_downstep(phrase) -> str:
+    """Render as plain kana, with a mark after the mora the pitch drops from"""
+    output = ""
+    for pron in phrase:
+        low_pre_rise, high, fall, _ = pron.sections
+        kana = "".join(pron.kana)
+        if fall != 0:
+            fall_end = low_pre_rise + high + fall
+            # The mark goes after the whole mora
+            while fall_end < len(kana) and kana[fall_end] in SMALL_KANA:
+                fall_end += 1
+            kana = kana[:fall_end] + DOWNSTEP_MARK + kana[fall_end:]
+        output += kana + (pron.particle or "")
+    return output
+
+
+RENDERERS = {
+    "html": render_html,
+    "svg": render_svg,
+    "json": render_json,
+    "downstep": render_downstep,
+}
 
 
-def getPronunciations(
-    expr: str, rdg: str = None, sanitize=True, recurse=True, prev_pitch_high=False
-) -> OrderedDict[str, list[tuple[str, bool]]]:
+# ************************************************
+#              Lookup Functions                  *
+# ************************************************
+def pron_to_hiragana(pron: Pronunciation) -> Pronunciation:
+    return pron._replace(
+        kana=tuple(katakana_to_hiragana(char) for char in pron.kana),
+        particle=(
+            katakana_to_hiragana(pron.particle) if pron.particle is not None else None
+        ),
+    )
+
+
+class PronunciationEngine:
     """
-    Search pronuncations for a particular expression
+    Looks up and formats pronunciations using one set of settings.
 
-    Returns a dictionary mapping the expression (or sub-expressions contained
-    in the expression) to a list of html-styled pronunciations.
+    The dictionary is shared read-only, the lookup cache is thread-safe and the
+    Mecab segmenter serializes use of its pipe, so an engine can be used from
+    several threads at once, and several engines can share one dictionary.
     """
 
-    # Sanitize input
-    if sanitize:
-        expr = strip_html_markup(expr)
-        expr = expr.strip()
+    CACHE_SIZE = 10000
 
-    ret = OrderedDict()
+    def __init__(self, dictionary, settings, segmenter=None):
+        self.dictionary = dictionary
+        self.config = dict(settings)
+        self.segmenter = segmenter
 
-    # Separate out particles
-    particle = None
-    if config["parseParticles"] and expr not in thedict:
-        # The particle may be signalled in the original expression and/or the user-provided reading
-        expr_particle = None
-        rdg_particle = None
+        # A bad format would otherwise break rendering every card of the note types
+        if self.config["outputFormat"] not in RENDERERS:
+            showInfo(
+                "NHK-Pronunciation: unknown outputFormat {!r}, using html instead. "
+                "Choose one of: {}.".format(
+                    self.config["outputFormat"], ", ".join(RENDERERS)
+                )
+            )
+            self.config["outputFormat"] = "html"
+        self._cached_lookup = functools.lru_cache(maxsize=self.CACHE_SIZE)(self._lookup)
+
+    def clear_cache(self):
+        self._cached_lookup.cache_clear()
+
+    def entry_pronunciation(
+        self,
+        e: DatabaseEntry,
+        kana_spelling: str = None,
+        prev_pitch_high: bool = False,
+        particle: str = None,
+    ) -> Pronunciation:
+        """Work out the pronunciation of an entry from the data in the derivative database"""
+        kana = tuple(e.midashigo if kana_spelling is None else kana_spelling)
+        strlen = len(kana)
+        acclen = len(e.ac)
+        accent = "0" * (strlen - acclen) + e.ac
+
+        # Nasalization
+        nasal = ()
+        if self.config["includeNasalPronunciation"] and e.nasalpos != "-":
+            nasal = tuple(int(str_idx) - 1 for str_idx in e.nasalpos)
+
+        # Devoiced kana
+        devoiced = ()
+        if self.config["includeNoPronunciation"] and e.nopronpos != "-":
+            devoiced = tuple(int(str_idx) - 1 for str_idx in e.nopronpos)
+
+        # Each word has at most 1 rise and at most 1 fall in pitch, so we can split the word into 4 sections:
+        # 1. Low pitch, pre-rise
+        # 2. High pitch
+        # 3. Fall in pitch
+        # 4. Low pitch, post-fall
+        pre_fall, fall, low_post_fall = accent.partition("2")
+        low_pre_rise, rise_char, post_rise = pre_fall.partition("1")
+        high = rise_char + post_rise
+
+        if prev_pitch_high:
+            # Pitch stays high until it hits a fall
+            low_pre_rise, high = "", low_pre_rise + high
+
+        return Pronunciation(
+            kana,
+            (len(low_pre_rise), len(high), len(fall), len(low_post_fall)),
+            nasal,
+            devoiced,
+            particle,
+            len(fall) == 0,  # pitch ends high
+        )
 
-        if any(sep in expr for sep in config["particleSeparators"]):
-            expr, expr_particle = re.split(
-                pattern=f"[{','.join(config['particleSeparators'])}]",
-                string=expr,
-                maxsplit=1,
+    def format_entry(
+        self, e: DatabaseEntry, kana_spelling: str = None, prev_pitch_high: bool = False
+    ) -> tuple[str, bool]:
+        """Format an entry from the data in the derivative database to something that uses html"""
+        pron = self.entry_pronunciation(e, kana_spelling, prev_pitch_high)
+        return render_html((pron,)), pron.ended_high
+
+    def inline_style(self, txt):
+        """Map style classes to their inline version"""
+        if self.config["inlineStyle"]:
+            for k, v in self.config["styles"].items():
+                txt = txt.replace(k, v)
+
+        return txt
+
+    def supports_note_type(self, name: str) -> bool:
+        """Check if this is a supported note type. If no note type has been specified, all are."""
+        return not self.config["noteTypes"] or any(
+            nt.lower() in name.lower() for nt in self.config["noteTypes"]
+        )
+
+    def get_src_rdg_dst_fields(self, fields):
+        """Set source, kana reading, and destination fieldnames"""
+        src = None
+        srcIdx = None
+        rdg = None
+        rdgIdx = None
+        dst = None
+        dstIdx = None
+
+        for i, f in enumerate(self.config["srcFields"]):
+            if f in fields:
+                src = f
+                srcIdx = i
+                break
+
+        for i, f in enumerate(self.config["rdgFields"]):
+            if f in fields:
+                rdg = f
+                rdgIdx = i
+                break
+
+        for i, f in enumerate(self.config["dstFields"]):
+            if f in fields:
+                dst = f
+                dstIdx = i
+                break
+
+        return src, srcIdx, rdg, rdgIdx, dst, dstIdx
+
+    def sanitiseFieldSeparators(self, txt):
+        """Remove the particle and word separators, but not from html tags or sound references"""
+        parts = field_markup_regex.split(txt)
+        # Text and markup alternate, starting with text
+        for i in range(0, len(parts), 2):
+            no_particle_seps = re.sub(
+                pattern=f"[{','.join(self.config['particleSeparators'])}]",
+                repl="",
+                string=parts[i],
             )
-        if rdg and any(sep in rdg for sep in config["particleSeparators"]):
-            rdg, rdg_particle = re.split(
-                pattern=f"[{','.join(config['particleSeparators'])}]",
-                string=rdg,
-                maxsplit=1,
+            parts[i] = re.sub(
+                pattern=f"[{','.join(self.config['wordSeparators'])}]",
+                repl="",
+                string=no_particle_seps,
             )
+        return "".join(parts)
+
+    def getStructuredPronunciations(
+        self,
+        expr: str,
+        rdg: str = None,
+        sanitize=True,
+        recurse=True,
+        prev_pitch_high=False,
+        particle=None,
+    ) -> OrderedDict[str, list[Pronunciation]]:
+        """
+        Search pronuncations for a particular expression
 
-        # Sanity check that everything aligns properly
-        if expr_particle is not None and rdg_particle is not None:
-            if expr_particle != rdg_particle:
-                return ret
-        elif rdg_particle is not None:
-            expr, expr_particle = expr[: -len(rdg_particle)], expr[-len(rdg_particle) :]
-            if expr_particle != rdg_particle:
-                return ret
-        elif expr_particle is not None and rdg:
-            rdg, rdg_particle = rdg[: -len(expr_particle)], rdg[-len(expr_particle) :]
-            if expr_particle != rdg_particle:
-                return ret
-
-        particle = expr_particle
-
-    if expr in thedict:
-        styled_prons = []
-
-        # If we have a kana reading hint, use that to filter the options
-        if rdg:
-            ktk_reading = hiragana_to_katakana(rdg)
-
-        for database_entry in thedict[expr]:
-            have_preserved_kana_spelling = False
-            if rdg:
-                if database_entry.midashigo != ktk_reading:
-                    continue
-                elif config["preserveKanaSpelling"]:
-                    # We found a pronunciation with the same kana and long-vowel transcription as the user-provided reading, so we are safe to use the user-provided one directly
-                    have_preserved_kana_spelling = True
-
-            pron, ended_high = format_entry(
-                database_entry,
-                rdg if have_preserved_kana_spelling else None,
-                prev_pitch_high,
+        Returns a dictionary mapping the expression (or sub-expressions contained
+        in the expression) to a list of pronunciations. A particle that was
+        already split off the expression can be passed in to attach to them.
+        """
+        return OrderedDict(
+            (k, list(v))
+            for k, v in self._cached_lookup(
+                expr, rdg, sanitize, recurse, prev_pitch_high, particle
             )
-            if particle is not None:
-                pron += f'<span class="pitch-particle">{particle}</span>'
-
-            inlinepron = inline_style(pron)
-
-            if config["preserveKanaSpelling"] and not have_preserved_kana_spelling:
-                # If there's no katakana in the expression, we'd prefer to use hiragana
-                if all(c not in KATAKANA for c in expr):
-                    inlinepron = katakana_to_hiragana(inlinepron)
-            elif config["pronunciationHiragana"] and not have_preserved_kana_spelling:
-                inlinepron = katakana_to_hiragana(inlinepron)
-
-            if (inlinepron, ended_high) not in styled_prons:
-                styled_prons.append((inlinepron, ended_high))
-
-        ret[expr] = styled_prons
-
-    elif recurse:
-        # Try to split the expression in various ways, and check if any of those results
-        split_expr = split_separators(expr)
-
-        if len(split_expr) > 1:
-            for expr in split_expr:
-                ret.update(getPronunciations(expr, sanitize=sanitize))
-
-        # Only if lookups were not succesful, we try splitting with Mecab
-        if not ret and lookup_mecab:
-            for sub_expr in mecab_reader.reading(expr).split():
-                # Avoid infinite recursion by saying that we should not try
-                # Mecab again if we do not find any matches for this sub-
-                # expression.
-                ret.update(
-                    getPronunciations(sub_expr, sanitize=sanitize, recurse=False)
+        )
+
+    def _lookup(
+        self,
+        expr: str,
+        rdg: str = None,
+        sanitize=True,
+        recurse=True,
+        prev_pitch_high=False,
+        particle=None,
+    ) -> tuple[tuple[str, tuple[Pronunciation, ...]], ...]:
+        """The uncached lookup behind getStructuredPronunciations"""
+
+        # Sanitize input
+        if sanitize:
+            expr = strip_html_markup(expr)
+            expr = expr.strip()
+
+        ret = OrderedDict()
+
+        # Separate out particles
+        if self.config["parseParticles"] and not self.dictionary.find_keys(expr):
+            # The particle may be signalled in the original expression and/or the user-provided reading
+            expr_particle = None
+            rdg_particle = None
+
+            if any(sep in expr for sep in self.config["particleSeparators"]):
+                expr, expr_particle = re.split(
+                    pattern=f"[{','.join(self.config['particleSeparators'])}]",
+                    string=expr,
+                    maxsplit=1,
+                )
+            if rdg and any(sep in rdg for sep in self.config["particleSeparators"]):
+                rdg, rdg_particle = re.split(
+                    pattern=f"[{','.join(self.config['particleSeparators'])}]",
+                    string=rdg,
+                    maxsplit=1,
+                )
+
+            # Sanity check that everything aligns properly
+            if expr_particle is not None and rdg_particle is not None:
+                if expr_particle != rdg_particle:
+                    return ()
+            elif rdg_particle is not None:
+                expr, expr_particle = (
+                    expr[: -len(rdg_particle)],
+                    expr[-len(rdg_particle) :],
+                )
+                if expr_particle != rdg_particle:
+                    return ()
+            elif expr_particle is not None and rdg:
+                rdg, rdg_particle = (
+                    rdg[: -len(expr_particle)],
+                    rdg[-len(expr_particle) :],
                 )
+                if expr_particle != rdg_particle:
+                    return ()
 
-    return ret
+            if expr_particle is not None:
+                particle = expr_particle
 
+        dict_keys = self.dictionary.find_keys(expr, rdg)
+        if dict_keys:
+            prons = []
 
-def getFormattedPronunciations(
-    expr: str,
-    rdg: str = None,
-    sep_single=" *** ",
-    sep_multi="<br/>\n",
-    expr_sep=None,
-    sanitize=True,
-):
-    if not config["parseWords"] or not any(
-        sep in expr for sep in config["wordSeparators"]
-    ):
-        prons = getPronunciations(expr, rdg, sanitize=sanitize)
-    else:
-        # Word boundaries must be signalled by the user in the expression
-        expr_words = re.split(
-            pattern=f"[{','.join(config['wordSeparators'])}]",
-            string=expr,
-        )
+            # If we have a kana reading hint, use that to filter the options
+            if rdg:
+                ktk_reading = hiragana_to_katakana(rdg)
+
+            for database_entry in (
+                e for key in dict_keys for e in self.dictionary.thedict[key]
+            ):
+                have_preserved_kana_spelling = False
+                if rdg:
+                    if database_entry.midashigo != ktk_reading:
+                        continue
+                    elif self.config["preserveKanaSpelling"]:
+                        # We found a pronunciation with the same kana and long-vowel transcription as the user-provided reading, so we are safe to use the user-provided one directly
+                        have_preserved_kana_spelling = True
+
+                pron = self.entry_pronunciation(
+                    database_entry,
+                    rdg if have_preserved_kana_spelling else None,
+                    prev_pitch_high,
+                    particle,
+                )
+
+                if (
+                    self.config["preserveKanaSpelling"]
+                    and not have_preserved_kana_spelling
+                ):
+                    # If there's no katakana in the expression, we'd prefer to use hiragana
+                    if all(c not in KATAKANA for c in expr):
+                        pron = pron_to_hiragana(pron)
+                elif (
+                    self.config["pronunciationHiragana"]
+                    and not have_preserved_kana_spelling
+                ):
+                    pron = pron_to_hiragana(pron)
+
+                if pron not in prons:
+                    prons.append(pron)
+
+            ret[expr] = prons
+
+        elif recurse:
+            # Try to split the expression in various ways, and check if any of those results
+            split_expr = split_separators(expr)
+
+            if len(split_expr) > 1:
+                for sub_expr in split_expr:
+                    ret.update(
+                        self.getStructuredPronunciations(sub_expr, sanitize=sanitize)
+                    )
+
+            # If that fails, the expression may be conjugated. A reading has to
+            # be conjugated the same way, i.e. deinflect to the same word class.
+            if not ret and self.config["useDeinflection"]:
+                rdg_forms = deinflect(rdg) if rdg else [(None, ANY)]
+                for base_form, word_class in deinflect(expr):
+                    if not self.dictionary.find_keys(base_form):
+                        continue
+                    for base_rdg, rdg_class in rdg_forms:
+                        if not rdg_class & word_class:
+                            continue
+                        found = self.getStructuredPronunciations(
+                            base_form,
+                            base_rdg,
+                            sanitize=sanitize,
+                            recurse=False,
+                            prev_pitch_high=prev_pitch_high,
+                            particle=particle,
+                        )
+                        if any(found.values()):
+                            ret.update(found)
+                            break
+                    if ret:
+                        break
+
+            # Only if lookups were not succesful, we try splitting with Mecab
+            if not ret and self.segmenter is not None:
+                for sub_expr in self.segmenter.reading(expr).split():
+                    # Avoid infinite recursion by saying that we should not try
+                    # Mecab again if we do not find any matches for this sub-
+                    # expression.
+                    ret.update(
+                        self.getStructuredPronunciations(
+                            sub_expr, sanitize=sanitize, recurse=False
+                        )
+                    )
+
+        return tuple((k, tuple(v)) for k, v in ret.items())
+
+    def getPronunciations(
+        self,
+        expr: str,
+        rdg: str = None,
+        sanitize=True,
+        recurse=True,
+        prev_pitch_high=False,
+    ) -> OrderedDict[str, list[tuple[str, bool]]]:
+        """
+        Search pronuncations for a particular expression
 
-        # If we have a reading, use it iff it has the same parse
-        if rdg:
-            rdg_words = re.split(
-                pattern=f"[{','.join(config['wordSeparators'])}]",
-                string=rdg,
+        Returns a dictionary mapping the expression (or sub-expressions contained
+        in the expression) to a list of html-styled pronunciations.
+        """
+        ret = OrderedDict()
+        for key, prons in self.getStructuredPronunciations(
+            expr, rdg, sanitize, recurse, prev_pitch_high
+        ).items():
+            styled_prons = []
+            for pron in prons:
+                styled_pron = (self.inline_style(render_html((pron,))), pron.ended_high)
+                if styled_pron not in styled_prons:
+                    styled_prons.append(styled_pron)
+            ret[key] = styled_prons
+
+        return ret
+
+    def getFormattedPronunciations(
+        self,
+        expr: str,
+        rdg: str = None,
+        sep_single=" *** ",
+        sep_multi="<br/>\n",
+        expr_sep=None,
+        sanitize=True,
+        output_format=None,
+    ):
+        if not self.config["parseWords"] or not any(
+            sep in expr for sep in self.config["wordSeparators"]
+        ):
+            phrases = OrderedDict(
+                (k, [(pron,) for pron in prons])
+                for k, prons in self.getStructuredPronunciations(
+                    expr, rdg, sanitize=sanitize
+                ).items()
             )
-            if len(expr_words) != len(rdg_words):
-                # They don't match, discard the user-supplied reading
-                rdg_words = [None for _ in expr_words]
         else:
-            rdg_words = [None for _ in expr_words]
+            # Word boundaries must be signalled by the user in the expression
+            expr_words = re.split(
+                pattern=f"[{','.join(self.config['wordSeparators'])}]",
+                string=expr,
+            )
 
-        prev_pitch_high = False
-        phrase_pron = ""
-        for expr_word, rdg_word in zip(expr_words, rdg_words):
-            word_prons_dict = getPronunciations(
-                expr_word, rdg_word, sanitize=sanitize, prev_pitch_high=prev_pitch_high
+            # If we have a reading, use it iff it has the same parse
+            if rdg:
+                rdg_words = re.split(
+                    pattern=f"[{','.join(self.config['wordSeparators'])}]",
+                    string=rdg,
+                )
+                if len(expr_words) != len(rdg_words):
+                    # They don't match, discard the user-supplied reading
+                    rdg_words = [None for _ in expr_words]
+            else:
+                rdg_words = [None for _ in expr_words]
+
+            prev_pitch_high = False
+            phrase = []
+            for expr_word, rdg_word in zip(expr_words, rdg_words):
+                word_prons_dict = self.getStructuredPronunciations(
+                    expr_word,
+                    rdg_word,
+                    sanitize=sanitize,
+                    prev_pitch_high=prev_pitch_high,
+                )
+                try:
+                    first_word_key = next(iter(word_prons_dict.keys()))
+                    word_pron = word_prons_dict[first_word_key][0]
+                    prev_pitch_high = word_pron.ended_high
+                    phrase.append(word_pron)
+                except StopIteration:
+                    # Something doesn't have a pronunciation, abort
+                    phrase = []
+                    break
+            phrases = OrderedDict()
+            phrases[expr] = [tuple(phrase)]
+
+        output_format = output_format or self.config["outputFormat"]
+        render = RENDERERS[output_format]
+
+        single_merge = OrderedDict()
+        for k, phrase_list in phrases.items():
+            rendered = []
+            for phrase in phrase_list:
+                txt = render(phrase)
+                if output_format == "html":
+                    txt = self.inline_style(txt)
+                if txt not in rendered:
+                    rendered.append(txt)
+            single_merge[k] = sep_single.join(rendered)
+
+        if expr_sep:
+            txt = sep_multi.join(
+                ["{}{}{}".format(k, expr_sep, v) for k, v in single_merge.items()]
             )
-            try:
-                first_word_key = next(iter(word_prons_dict.keys()))
-                word_pron, prev_pitch_high = word_prons_dict[first_word_key][0]
-                phrase_pron += word_pron
-            except StopIteration:
-                # Something doesn't have a pronunciation, abort
-                phrase_pron = ""
-                break
-        prons = OrderedDict()
-        prons[expr] = [(phrase_pron, prev_pitch_high)]
+        else:
+            txt = sep_multi.join(single_merge.values())
 
-    single_merge = OrderedDict()
-    for k, vlist in prons.items():
-        single_merge[k] = sep_single.join([v for v, _ in vlist])
+        return txt
 
-    if expr_sep:
-        txt = sep_multi.join(
-            ["{}{}{}".format(k, expr_sep, v) for k, v in single_merge.items()]
-        )
-    else:
-        txt = sep_multi.join(single_merge.values())
 
-    return txt
+# The engine used by the Anki hooks, created from the add-on config on first use
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine() -> PronunciationEngine:
+    global engine
+
+    if engine is None:
+        with engine_lock:
+            if engine is None:
+                # Check if Mecab is available and/or if the user wants it to be used
+                segmenter = None
+                if config["useMecab"]:
+                    mecab_base_path = find_mecab()
+                    if mecab_base_path is not None:
+                        segmenter = MecabController(mecab_base_path)
+                    else:
+                        showInfo(
+                            "NHK-Pronunciation: Mecab use requested, but Japanese "
+                            "add-on with Mecab not found."
+                        )
+                engine = PronunciationEngine(load_dictionary(), config, segmenter)
+    return engine
+
+
+# Shortcuts to the default engine
+def getStructuredPronunciations(*args, **kwargs):
+    return get_engine().getStructuredPronunciations(*args, **kwargs)
+
+
+def getPronunciations(*args, **kwargs):
+    return get_engine().getPronunciations(*args, **kwargs)
+
+
+def getFormattedPronunciations(*args, **kwargs):
+    return get_engine().getFormattedPronunciations(*args, **kwargs)
+
+
+def queryPitchPatterns(*args, **kwargs):
+    return get_engine().dictionary.queryPitchPatterns(*args, **kwargs)
+
+
+def format_entry(*args, **kwargs):
+    return get_engine().format_entry(*args, **kwargs)
+
+
+def get_src_rdg_dst_fields(fields):
+    return get_engine().get_src_rdg_dst_fields(fields)
+
+
+def sanitiseFieldSeparators(txt):
+    return get_engine().sanitiseFieldSeparators(txt)
 
 
 def lookupPronunciation(expr):
     """Show the pronunciation when the user does a manual lookup"""
-    txt = getFormattedPronunciations(expr, None, "<br/>\n", "<br/><br/>\n", ":<br/>\n")
+    txt = getFormattedPronunciations(
+        expr, None, "<br/>\n", "<br/><br/>\n", ":<br/>\n", output_format="html"
+    )
 
     thehtml = (
         """
@@ -636,6 +1598,90 @@ def onLookupPronunciation():
 # ************************************************
 
 
+class PitchSearchDialog(QDialog):
+    """Search the dictionary by pitch pattern, loading results a page at a time"""
+
+    PAGE_SIZE = 100
+
+    def __init__(self, parent=None):
+        super(PitchSearchDialog, self).__init__(parent)
+        self.setWindowTitle("Pitch Accent Search")
+        self.results = iter(())
+
+        self.morae = QSpinBox()
+        self.morae.setRange(0, 20)
+        self.morae.setSpecialValueText("Any")
+        self.downstep = QSpinBox()
+        self.downstep.setRange(-1, 20)
+        self.downstep.setSpecialValueText("Any")
+        self.pattern = QComboBox()
+        self.pattern.addItems(["Any"] + PITCH_PATTERNS)
+        self.nasal = QComboBox()
+        self.nasal.addItems(["Any", "Yes", "No"])
+        self.devoiced = QComboBox()
+        self.devoiced.addItems(["Any", "Yes", "No"])
+        self.prefix = QLineEdit()
+
+        form = QFormLayout()
+        form.addRow("Morae", self.morae)
+        form.addRow("Downstep after mora", self.downstep)
+        form.addRow("Pattern", self.pattern)
+        form.addRow("Nasal kana", self.nasal)
+        form.addRow("Devoiced kana", self.devoiced)
+        form.addRow("Starts with", self.prefix)
+
+        search_button = QPushButton("Search")
+        search_button.setDefault(True)
+        search_button.clicked.connect(self.onSearch)
+        self.more_button = QPushButton("More")
+        self.more_button.setEnabled(False)
+        self.more_button.clicked.connect(self.loadPage)
+        self.result_list = QListWidget()
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(search_button)
+        buttons.addWidget(self.more_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(form)
+        layout.addLayout(buttons)
+        layout.addWidget(self.result_list)
+        self.setLayout(layout)
+
+    def onSearch(self):
+        yes_no = {"Any": None, "Yes": True, "No": False}
+        self.results = queryPitchPatterns(
+            morae=self.morae.value() or None,
+            downstep=self.downstep.value() if self.downstep.value() >= 0 else None,
+            pattern=(
+                self.pattern.currentText() if self.pattern.currentIndex() > 0 else None
+            ),
+            nasal=yes_no[self.nasal.currentText()],
+            devoiced=yes_no[self.devoiced.currentText()],
+            prefix=self.prefix.text().strip() or None,
+        )
+        self.result_list.clear()
+        self.loadPage()
+
+    def loadPage(self):
+        page = list(itertools.islice(self.results, self.PAGE_SIZE))
+        for exprs, database_entry in page:
+            self.result_list.addItem(
+                "{}  [{}]  {}".format(
+                    katakana_to_hiragana(database_entry.midashigo),
+                    entry_pitch_key(database_entry)[1],
+                    "・".join(
+                        expr for expr in exprs if expr != database_entry.midashigo
+                    ),
+                )
+            )
+        self.more_button.setEnabled(len(page) == self.PAGE_SIZE)
+
+
+def onPitchSearch():
+    PitchSearchDialog(mw).exec()
+
+
 def createMenu():
     """Add a hotkey and menu entry"""
     if not getattr(mw.form, "menuLookup", None):
@@ -653,6 +1699,11 @@ def createMenu():
     ml.addAction(a)
     a.triggered.connect(onLookupPronunciation)
 
+    a = QAction(mw)
+    a.setText("Pitch Accent Search...")
+    mw.form.menuTools.addAction(a)
+    a.triggered.connect(onPitchSearch)
+
 
 def setupBrowserMenu(browser):
     """Add menu entry to browser window"""
@@ -666,136 +1717,280 @@ def onRegenerate(browser):
     regeneratePronunciations(browser.selectedNotes())
 
 
-def get_src_rdg_dst_fields(fields):
-    """Set source, kana reading, and destination fieldnames"""
-    src = None
-    srcIdx = None
-    rdg = None
-    rdgIdx = None
-    dst = None
-    dstIdx = None
-
-    for i, f in enumerate(config["srcFields"]):
-        if f in fields:
-            src = f
-            srcIdx = i
-            break
-
-    for i, f in enumerate(config["rdgFields"]):
-        if f in fields:
-            rdg = f
-            rdgIdx = i
-            break
-
-    for i, f in enumerate(config["dstFields"]):
-        if f in fields:
-            dst = f
-            dstIdx = i
-            break
-
-    return src, srcIdx, rdg, rdgIdx, dst, dstIdx
-
-
-def sanitiseFieldSeparators(txt):
-    no_particle_seps = re.sub(
-        pattern=f"[{','.join(config['particleSeparators'])}]", repl="", string=txt
-    )
-    return re.sub(
-        pattern=f"[{','.join(config['wordSeparators'])}]",
-        repl="",
-        string=no_particle_seps,
-    )
-
-
 def add_pronunciation_once(fields, model, data, n):
     """When possible, temporarily set the pronunciation to a field"""
+    engine = get_engine()
 
     # Check if this is a supported note type. If it is not, return.
-    # If no note type has been specified, we always continue the lookup proces.
-    if config["noteTypes"] and not any(
-        nt.lower() in model["name"].lower() for nt in config["noteTypes"]
-    ):
+    if not engine.supports_note_type(model["name"]):
         return fields
 
-    src, _, rdg, _, dst, _ = get_src_rdg_dst_fields(fields)
+    src, _, rdg, _, dst, _ = engine.get_src_rdg_dst_fields(fields)
 
     if src is None or dst is None:
         return fields
 
     # Only add the pronunciation if there's not already one in the pronunciation field
     if not fields[dst]:
-        fields[dst] = getFormattedPronunciations(fields[src], fields[rdg])
-        if config["removeSeparatorsFromSrcField"]:
-            fields[src] = sanitiseFieldSeparators(fields[src])
+        fields[dst] = engine.getFormattedPronunciations(
+            fields[src], fields[rdg] if rdg else None
+        )
+        if engine.config["removeSeparatorsFromSrcField"]:
+            fields[src] = engine.sanitiseFieldSeparators(fields[src])
     return fields
 
 
-def add_pronunciation_note_add(n: anki.notes.Note) -> None:
+def fill_pronunciation(n: "anki.notes.Note", edit_src: bool = True) -> bool:
+    """
+    Set the pronunciation of a note with an empty destination field, without
+    saving it. With edit_src off, only the destination field is written.
+    """
+    engine = get_engine()
+
     # Check if this is a supported note type. If it is not, return.
-    # If no note type has been specified, we always continue the lookup proces.
-    if config["noteTypes"] and not any(
-        nt.lower() in n.model()["name"].lower() for nt in config["noteTypes"]
-    ):
-        return
+    if not engine.supports_note_type(n.model()["name"]):
+        return False
 
     fields = mw.col.models.fieldNames(n.model())
 
-    src, srcIdx, rdg, rdgIdx, dst, dstIdx = get_src_rdg_dst_fields(fields)
+    src, srcIdx, rdg, rdgIdx, dst, dstIdx = engine.get_src_rdg_dst_fields(fields)
 
     if not src or not dst:
-        return
+        return False
 
     # dst field already filled?
     if n[dst]:
-        return
+        return False
 
     # grab source text
     srcTxt = mw.col.media.strip(n[src])
     if not srcTxt:
-        return
+        return False
 
     # update field
-    try:
-        rdgTxt = mw.col.media.strip(n[rdg])
-        n[dst] = getFormattedPronunciations(srcTxt, rdg=rdgTxt)
-        if config["removeSeparatorsFromSrcField"]:
-            n[src] = sanitiseFieldSeparators(srcTxt)
+    rdgTxt = mw.col.media.strip(n[rdg]) if rdg else ""
+    n[dst] = engine.getFormattedPronunciations(srcTxt, rdg=rdgTxt)
+    if edit_src and engine.config["removeSeparatorsFromSrcField"]:
+        # Strip the raw field, as srcTxt no longer has the field's media
+        n[src] = engine.sanitiseFieldSeparators(n[src])
+    return True
+
+
+def add_pronunciation_note_add(n: "anki.notes.Note") -> None:
+    if fill_pronunciation(n):
         mw.col.update_note(n)
-    except Exception as e:
-        raise
+
+
+class BackgroundFiller:
+    """
+    Fill empty pronunciation fields of notes that were not added through the
+    Add window (e.g. imported or synced), a few at a time while Anki is idle.
+    """
+
+    # How often to check for idleness, and the most time a single batch may take
+    TICK_MS = 1000
+    SLICE_SECONDS = 0.05
+    # The budget needed to fill one note, in milliseconds per minute
+    NOTE_COST = 60000
+    # How long to wait before searching again once no more empty notes are found
+    SEARCH_BACKOFF_SECONDS = 600
+
+    def __init__(self):
+        self.timer = None
+        self.queue = []
+        self.tried = set()
+        self.idle_since = None
+        self.next_search = 0
+        # Budget for filling notes without going over the configured rate
+        self.budget = 0
+
+    def start(self):
+        if self.timer is None:
+            self.timer = QTimer(mw)
+            self.timer.timeout.connect(self.on_tick)
+        self.queue = []
+        self.next_search = 0
+        self.budget = 0
+        self.pause()
+        self.timer.start(self.TICK_MS)
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+        self.queue = []
+        self.tried = set()
+
+    def pause(self, *args):
+        """Hold off until Anki has been idle for a while again"""
+        self.idle_since = None
+
+    @staticmethod
+    def is_idle():
+        return (
+            mw.col is not None
+            and mw.state in ("deckBrowser", "overview")
+            and mw.app.activeModalWidget() is None
+            and mw.app.activeWindow() in (None, mw)
+        )
+
+    @staticmethod
+    def search_query():
+        """Search for notes of the configured note types with an empty pronunciation field"""
+        engine = get_engine()
+        terms = []
+        if engine.config["noteTypes"]:
+            terms.append(
+                " OR ".join(
+                    '"note:*{}*"'.format(nt) for nt in engine.config["noteTypes"]
+                )
+            )
+        terms.append(" OR ".join('"{}:"'.format(f) for f in engine.config["dstFields"]))
+        return " ".join("({})".format(t) for t in terms)
+
+    def on_tick(self):
+        now = time.monotonic()
+        if not self.is_idle():
+            self.pause()
+            return
+        if self.idle_since is None:
+            self.idle_since = now
+        engine = get_engine()
+        if now - self.idle_since < engine.config["backgroundFillIdleSeconds"]:
+            return
+
+        if not self.queue:
+            if now < self.next_search:
+                return
+            self.queue = [
+                nid
+                for nid in mw.col.find_notes(self.search_query())
+                if nid not in self.tried
+            ]
+            if not self.queue:
+                self.next_search = now + self.SEARCH_BACKOFF_SECONDS
+                return
+
+        # Rate limit the notes per tick, and stop early if the batch runs long.
+        # Each note costs a minute's worth of the budget, which is carried over
+        # between ticks so that rates below one note per tick are kept too.
+        per_tick = engine.config["backgroundFillNotesPerMinute"] * self.TICK_MS
+        self.budget = min(self.budget + per_tick, per_tick + self.NOTE_COST)
+        deadline = time.monotonic() + self.SLICE_SECONDS
+        notes = []
+        while (
+            self.queue and self.budget >= self.NOTE_COST and time.monotonic() < deadline
+        ):
+            nid = self.queue.pop()
+            self.tried.add(nid)
+            self.budget -= self.NOTE_COST
+            note = mw.col.get_note(nid)
+            if fill_pronunciation(note, edit_src=False):
+                notes.append(note)
+
+        if notes:
+            # Keep the undo history to the user's own actions
+            mw.col.update_notes(notes, skip_undo_entry=True)
+
+
+background_filler = BackgroundFiller()
+
+
+def on_state_did_change(new_state, old_state):
+    if new_state == "review":
+        background_filler.pause()
+
+
+def fingerprints_path():
+    """Sidecar file with the fingerprints of the notes regenerated so far"""
+    return os.path.join(
+        user_files_path, "regenerated_fingerprints_{}.json".format(mw.pm.name)
+    )
+
+
+def read_fingerprints():
+    try:
+        with open(fingerprints_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_fingerprints(fingerprints):
+    if not os.path.exists(user_files_path):
+        os.makedirs(user_files_path)
+    with open(fingerprints_path(), "w", encoding="utf-8") as f:
+        json.dump(fingerprints, f)
+
+
+def note_fingerprint(src_txt, rdg_txt, config_fingerprint):
+    """Identify everything a note's generated pronunciation depends on"""
+    return hashlib.sha1(
+        json.dumps(
+            [src_txt, rdg_txt, get_engine().dictionary.signature, config_fingerprint]
+        ).encode("utf-8")
+    ).hexdigest()
 
 
 def regeneratePronunciations(nids):
     mw.checkpoint("Bulk-add Pronunciations")
     mw.progress.start()
+
+    engine = get_engine()
+    incremental = engine.config["incrementalRegeneration"]
+    fingerprints = read_fingerprints() if incremental else {}
+    config_fingerprint = hashlib.sha1(
+        json.dumps(engine.config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
     for nid in nids:
         note = mw.col.getNote(nid)
 
         # Check if this is a supported note type. If it is not, skip.
-        # If no note type has been specified, we always continue the lookup proces.
-        if config["noteTypes"] and not any(
-            nt.lower() in note.model()["name"].lower() for nt in config["noteTypes"]
-        ):
+        if not engine.supports_note_type(note.model()["name"]):
             continue
 
-        src, srcIdx, rdg, rdgIdx, dst, dstIdx = get_src_rdg_dst_fields(note)
+        src, srcIdx, rdg, rdgIdx, dst, dstIdx = engine.get_src_rdg_dst_fields(note)
 
         if src is None or dst is None:
             continue
 
-        if note[dst] and not config["regenerateReadings"]:
+        if note[dst] and not engine.config["regenerateReadings"]:
             # already contains data, skip
             continue
 
         srcTxt = mw.col.media.strip(note[src])
-        rdgTxt = mw.col.media.strip(note[rdg])
+        rdgTxt = mw.col.media.strip(note[rdg]) if rdg else ""
         if not srcTxt.strip():
             continue
 
-        note[dst] = getFormattedPronunciations(srcTxt, rdg=rdgTxt)
-        if config["removeSeparatorsFromSrcField"]:
-            note[src] = sanitiseFieldSeparators(srcTxt)
-        note.flush()
+        if (
+            incremental
+            and note[dst]
+            and fingerprints.get(str(nid))
+            == note_fingerprint(srcTxt, rdgTxt, config_fingerprint)
+        ):
+            # Nothing changed since the last time this note was generated, skip
+            continue
+
+        dstTxt = engine.getFormattedPronunciations(srcTxt, rdg=rdgTxt)
+        if engine.config["removeSeparatorsFromSrcField"]:
+            # Strip the raw field, as srcTxt no longer has the field's media
+            newSrcTxt = engine.sanitiseFieldSeparators(note[src])
+        else:
+            newSrcTxt = note[src]
+
+        # Only write notes that actually changed
+        if note[dst] != dstTxt or note[src] != newSrcTxt:
+            note[dst] = dstTxt
+            note[src] = newSrcTxt
+            note.flush()
+        if incremental:
+            fingerprints[str(nid)] = note_fingerprint(
+                mw.col.media.strip(note[src]), rdgTxt, config_fingerprint
+            )
+
+    if incremental:
+        write_fingerprints(fingerprints)
     mw.progress.finish()
     mw.reset()
 
@@ -804,35 +1999,23 @@ def regeneratePronunciations(nids):
 #                   Main                         *
 # ************************************************
 
-# First check that either the original database, or the derivative text file are present:
-if not os.path.exists(derivative_database) and not os.path.exists(accent_database):
-    raise IOError("Could not locate the original base or the derivative database!")
-
-# Generate the derivative database if it does not exist yet
-if (os.path.exists(accent_database) and not os.path.exists(derivative_database)) or (
-    os.path.exists(accent_database)
-    and os.stat(thisfile).st_mtime > os.stat(derivative_database).st_mtime
-):
-    build_database()
-
-# If a pickle exists of the derivative file, use that. Otherwise, read from the derivative file and generate a pickle.
-if (
-    os.path.exists(derivative_pickle)
-    and os.stat(derivative_pickle).st_mtime > os.stat(derivative_database).st_mtime
-):
-    with open(derivative_pickle, "rb") as f:
-        thedict = pickle.load(f)
-else:
-    read_derivative()
-    with open(derivative_pickle, "wb") as f:
-        pickle.dump(thedict, f, pickle.HIGHEST_PROTOCOL)
+if mw is not None:
+    # Load the dictionary as soon as a profile opens rather than on the first lookup
+    gui_hooks.profile_did_open.append(get_engine)
+
+    # Create the manual look-up menu entry
+    createMenu()
 
-# Create the manual look-up menu entry
-createMenu()
+    addHook("mungeFields", add_pronunciation_once)
 
-addHook("mungeFields", add_pronunciation_once)
+    gui_hooks.add_cards_did_add_note.append(add_pronunciation_note_add)
 
-gui_hooks.add_cards_did_add_note.append(add_pronunciation_note_add)
+    # Bulk add
+    addHook("browser.setupMenus", setupBrowserMenu)
 
-# Bulk add
-addHook("browser.setupMenus", setupBrowserMenu)
+    # Fill notes added outside the Add window in the background
+    if config["backgroundFill"]:
+        gui_hooks.profile_did_open.append(background_filler.start)
+        gui_hooks.profile_will_close.append(background_filler.stop)
+        gui_hooks.state_did_change.append(on_state_did_change)
+        gui_hooks.editor_did_load_note.append(background_filler.pause)
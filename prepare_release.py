@@ -1,5 +1,34 @@
+import os
+import subprocess
+import sys
 from zipfile import ZipFile
 
+import nhk_pronunciation
+
+# Parse the accent database once here, so that users don't have to on first start
+nhk_pronunciation.build_database()
+dictionary = nhk_pronunciation.PronunciationDictionary.build(
+    nhk_pronunciation.read_derivative()
+)
+dictionary.write_cache('nhk_pronunciation_dict.pickle.gz', compress=True)
+
+# Anki imports the add-on as a package from outside its folder, so check in a
+# fresh interpreter that the cache loads that way too
+check = subprocess.run(
+    [
+        sys.executable,
+        '-c',
+        'import importlib, sys; '
+        'nhk = importlib.import_module(sys.argv[1] + ".nhk_pronunciation"); '
+        'sys.exit(nhk.PronunciationDictionary.read_cache(sys.argv[2], True) is None)',
+        os.path.basename(os.getcwd()),
+        os.path.join(os.getcwd(), 'nhk_pronunciation_dict.pickle.gz'),
+    ],
+    cwd=os.pardir,
+)
+if check.returncode != 0:
+    raise RuntimeError('The prebuilt dictionary cache does not load in the add-on')
+
 with ZipFile('release_20.zip', 'w') as z:
     z.write('ACCDB_unicode.csv')
     z.write('config.json', 'nhk_pronunciation_config.json')
@@ -8,7 +37,7 @@ with ZipFile('release_20.zip', 'w') as z:
 
 with ZipFile('release_21.zip', 'w') as z:
     z.write('__init__.py')
-    z.write('ACCDB_unicode.csv')
+    z.write('nhk_pronunciation_dict.pickle.gz')
     z.write('config.json')
     z.write('config.md')
     z.write('nhk_pronunciation.py')